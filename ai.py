@@ -2,17 +2,33 @@
 """
 
 import math
-from collections import defaultdict, deque
+from array import array
+from collections import defaultdict, deque, OrderedDict
 
+import numpy as np
 import pymunk
 from pymunk import Vec2d, Space
 import gameobjects
-from gameobjects import Tank, GameObject, Box
+from gameobjects import Tank, GameObject, Box, add_game_object
 from maps import Map
 
+try:
+    from numba import njit
+    HAS_NUMBA = True
+except ImportError:  # Numba is optional, without it we use the pure python search instead
+    HAS_NUMBA = False
+
+    def njit(*args, **kwargs):
+        return lambda function: function
+
 # NOTE: use only 'map0' during development!
 
 MIN_ANGLE_DIF = math.radians(3)   # 3 degrees, a bit more than we can turn each tick
+BFS_CACHE_SIZE = 64  # How many (start, target) paths each ai remembers
+BFS_STEPS_PER_TICK = 256  # How many tiles the pure python search may visit each tick
+RAY_STEP = 3  # Length (in tiles) of each segment of the shooting raycast
+SHAPE_FILTER = pymunk.ShapeFilter()
+NEIGHBOR_OFFSETS = np.array(((1, 0), (0, 1), (-1, 0), (0, -1)), dtype=np.int8)
 
 
 def angle_between_vectors(vec1: Vec2d, vec2: Vec2d):
@@ -25,9 +41,118 @@ def angle_between_vectors(vec1: Vec2d, vec2: Vec2d):
 
 
 def periodic_difference_of_angles(angle1, angle2):
-    """ Compute the difference between two angles.
+    """ Compute the signed difference between two angles, in the range [-pi, pi].
+    """
+    return math.remainder(angle1 - angle2, math.tau)
+
+
+@njit(cache=True)
+def _bfs(passable, sx, sy, tx, ty):
+    """ Breadth first search over the passable grid, compiled to native code by numba.
+        Tiles are stored as the flat index y * width + x. Returns an (N, 2) array
+        with the coordinates of the path, not including the start tile.
+    """
+    height, width = passable.shape
+    size = width * height
+    queue = np.empty(size, dtype=np.int32)
+    parent = np.empty(size, dtype=np.int32)
+    visited = np.zeros(size, dtype=np.uint8)
+
+    start = sy * width + sx
+    target = ty * width + tx
+    queue[0] = start
+    visited[start] = 1
+    head = 0
+    tail = 1
+    while head < tail:
+        current = queue[head]
+        head += 1
+        if current == target:
+            length = 0
+            tile = target
+            while tile != start:
+                length += 1
+                tile = parent[tile]
+            path = np.empty((length, 2), dtype=np.int32)
+            tile = target
+            for i in range(length - 1, -1, -1):
+                path[i, 0] = tile % width
+                path[i, 1] = tile // width
+                tile = parent[tile]
+            return path
+
+        x = current % width
+        y = current // width
+        for i in range(4):
+            nx = x + NEIGHBOR_OFFSETS[i, 0]
+            ny = y + NEIGHBOR_OFFSETS[i, 1]
+            if 0 <= nx < width and 0 <= ny < height and passable[ny, nx]:
+                index = ny * width + nx
+                if not visited[index]:
+                    visited[index] = 1
+                    parent[index] = current
+                    queue[tail] = index
+                    tail += 1
+
+    return np.empty((0, 2), dtype=np.int32)
+
+
+def cast_ray(space: Space, ray: tuple[Vec2d, Vec2d, float]):
+    """ Makes a raycast query from position along direction, starting half a tile
+        away and ending at max_distance. The ray is split into short segments so
+        that the closest tiles are tested first, we can stop as soon as one of
+        the segments hits something.
+    """
+    position, direction, max_distance = ray
+    hit = None
+    distance = 0.5
+    end = position + direction * distance
+    while hit is None and distance < max_distance:
+        distance = min(distance + RAY_STEP, max_distance)
+        start = end  # Each segment starts where the previous one ended
+        end = position + direction * distance
+        hit = space.segment_query_first(start, end, 0, SHAPE_FILTER)
+    return hit
+
+
+def shoot_all(ais: list['Ai'], space: Space):
+    """ Makes the pending raycasts of all ai:s back to back, and then lets
+        each ai decide if it should shoot. Should be called after Ai.decide.
     """
-    return (angle1 % (2 * math.pi)) - (angle2 % (2 * math.pi))
+    hits = [cast_ray(space, ai.pending_ray) for ai in ais]
+    for ai, hit in zip(ais, hits):
+        ai.consume_ray_result(hit)
+
+
+def compile_bfs(passable):
+    """ Runs the numba search once, so that it is compiled before the game starts
+        instead of during the first tick.
+    """
+    if HAS_NUMBA:
+        _bfs(passable, 0, 0, 0, 0)
+
+
+class VisitedTiles:
+    """ Keeps track of the tiles visited by a breadth first search, shared by all ai:s.
+        Instead of clearing the grid before every search, each search gets a new
+        generation number and a tile counts as visited if it is marked with it.
+        Only one search can use it at a time, the ai running it is stored in owner.
+    """
+
+    def __init__(self, width: int, height: int):
+        self.size = width * height
+        self.generations = array('H', bytes(2 * self.size))  # Unsigned 16 bit ints, indexed by y * width + x
+        self.generation = 0
+        self.owner = None
+
+    def new_search(self, owner: 'Ai'):
+        """ Starts a new search where no tile is visited yet. """
+        self.owner = owner
+        self.generation += 1
+        if self.generation > 0xFFFF:
+            # Old marks would be mistaken for new ones once the counter wraps around
+            self.generations = array('H', bytes(2 * self.size))
+            self.generation = 1
 
 
 class Ai:
@@ -35,49 +160,69 @@ class Ai:
     a breadth first search. Also capable of shooting other tanks and or wooden
     boxes. """
 
-    def __init__(self, tank: Tank, game_objects_list: list[GameObject], tanks_list: list[Tank], space: Space, current_map: Map):
+    def __init__(self, tank: Tank, game_objects: dict[int, GameObject], tanks_list: list[Tank], space: Space, current_map: Map, visited: VisitedTiles):
         self.tank = tank
-        self.game_objects_list = game_objects_list
+        self.game_objects = game_objects
         self.tanks_list = tanks_list
         self.space = space
         self.current_map = current_map
         self.flag = None
         self.max_x = current_map.width - 1
         self.max_y = current_map.height - 1
+        self._w = current_map.width
+        self._h = current_map.height
+        self.passable = current_map.passable  # Shared by all ai:s
+        self.passable_bytes = current_map.passable_bytes
+        self.visited = visited
+        self._bfs_cache: OrderedDict[tuple[tuple[int, int], tuple[int, int]], deque] = OrderedDict()
+        self._bfs_que = deque()
+        self._bfs_came_from: dict[tuple[int, int], tuple[int, int] | None] = {}
+        self._bfs_target = None
+        self._bfs_path = None
 
         self.path = deque()
+        self.pending_ray = None
+        self.position = tank.body.position
+        self.rotation_vector = tank.body.rotation_vector
         self.move_cycle = self.move_cycle_gen()
         self.update_grid_pos()
 
     def update_grid_pos(self):
-        """ This should only be called in the beginning, or at the end of a move_cycle. """
-        self.grid_pos = self.get_tile_of_position(self.tank.body.position)
+        """ This should only be called in the beginning, or at the end of a move_cycle.
+            grid_pos is stored as an (x, y) tuple of ints. """
+        self.grid_pos = self.get_tile_of_position(self.position)
 
     def decide(self):
         """ Main decision function that gets called on every tick of the game.
+            The position and rotation of the tank are read once here and then
+            shared by the shooting and the moving. Shooting is finished later
+            by consume_ray_result, so that the raycasts of all ai:s can be made together.
         """
-        bullet = self.maybe_shoot()
-        if bullet is not None:
-            self.game_objects_list.append(bullet)
-
+        body = self.tank.body
+        self.position = body.position
+        self.rotation_vector = body.rotation_vector
+        self.prepare_shoot(self.position, self.rotation_vector)
         next(self.move_cycle)
 
-    def maybe_shoot(self):
-        """ Makes a raycast query in front of the tank. If another tank
-            or a wooden box is found, then we shoot.
+    def prepare_shoot(self, position: Vec2d, rotation_vector: Vec2d):
+        """ Stores the raycast we want to make in front of the tank in pending_ray,
+            as a tuple of (position, direction, max_distance).
+        """
+        direction: Vec2d = rotation_vector.perpendicular()  # The rotation vector is a unit vector, so no scaling is needed
+        self.pending_ray = (position, direction, self.max_x + self.max_y)
+
+    def consume_ray_result(self, hit):
+        """ Takes the result of our pending raycast. If another tank
+            or a wooden box was found, then we shoot.
         """
-        direction: Vec2d = self.tank.body.rotation_vector.rotated(math.pi / 2)
-        start_offset = direction.scale_to_length(0.5)
-        end_offset = direction.scale_to_length(self.max_x + self.max_y)
-        start = self.tank.body.position + start_offset
-        end = self.tank.body.position + end_offset
-        hit = self.space.segment_query_first(start, end, 0, pymunk.ShapeFilter())
         if hit is not None and hasattr(hit, 'shape') and hasattr(hit.shape, 'parent'):
             hit_obj = hit.shape.parent
             is_tank = isinstance(hit_obj, Tank)
             is_wood_box = isinstance(hit_obj, Box) and hit.shape.parent.destructible
             if is_tank or is_wood_box:
-                return self.tank.shoot(self.space)
+                bullet = self.tank.shoot(self.space)
+                if bullet is not None:
+                    add_game_object(self.game_objects, bullet)
 
     def move_cycle_gen(self):
         """ A generator that iteratively goes through all the required steps
@@ -85,54 +230,124 @@ class Ai:
         """
         while True:
             # find path
-            path = self.find_shortest_path()
+            path = yield from self.find_shortest_path()
             if not path:
                 yield
                 continue
             next_coord = path.popleft()
 
             # turning
-            target_vector = Vec2d(*next_coord) - self.grid_pos
-            current_angle = target_vector.get_angle_between(self.tank.body.rotation_vector.rotated_degrees(90))
-            if current_angle > MIN_ANGLE_DIF:
-                self.tank.turn_left()
-            elif current_angle < -MIN_ANGLE_DIF:
-                self.tank.turn_right()
+            dx = next_coord[0] - self.grid_pos[0]
+            dy = next_coord[1] - self.grid_pos[1]
+            current_angle = self.angle_to_target(dx, dy, self.rotation_vector)
+            # sign is 1 if we should turn left, -1 if we should turn right and 0 if we are already facing the target
+            sign = (current_angle > MIN_ANGLE_DIF) - (current_angle < -MIN_ANGLE_DIF)
+            (self.tank.turn_right, self.tank.stop_turning, self.tank.turn_left)[sign + 1]()
             while abs(current_angle) > MIN_ANGLE_DIF:
                 self.tank.stop_moving()
                 yield
-                current_angle = target_vector.get_angle_between(self.tank.body.rotation_vector.rotated_degrees(90))
+                current_angle = self.angle_to_target(dx, dy, self.rotation_vector)
             self.tank.stop_turning()
 
             # driving
             self.tank.accelerate()
-            target_center = next_coord + (0.5, 0.5)
-            distance = target_center.get_distance(self.tank.body.position)
+            tx = next_coord[0] + 0.5
+            ty = next_coord[1] + 0.5
+            px, py = self.position
+            distance = math.hypot(tx - px, ty - py)
             prev_distance = distance + 1
             while distance < prev_distance:
                 yield
                 prev_distance = distance
-                distance = target_center.get_distance(self.tank.body.position)
+                px, py = self.position
+                distance = math.hypot(tx - px, ty - py)
             self.update_grid_pos()
 
+    def angle_to_target(self, dx, dy, rotation_vector):
+        """ Returns the signed angle between the direction (dx, dy) and the direction
+            of a tank with the given rotation vector. Positive means that we should turn left.
+        """
+        rx = -rotation_vector[1]  # The direction the tank is facing is its rotation vector rotated 90 degrees
+        ry = rotation_vector[0]
+        return math.atan2(dx * ry - dy * rx, dx * rx + dy * ry)
+
     def find_shortest_path(self):
-        """ A simple Breadth First Search using integer coordinates as our nodes.
-            Edges are calculated as we go, using an external function.
+        """ Returns the shortest path from our tile to the target tile, use it with yield from.
+            The map never changes for the ai, so the latest paths are cached
+            and reused whenever we plan from the same tile to the same target.
         """
-        paths: dict[Vec2d, list[Vec2d]] = {self.grid_pos: []}
-        que = deque((self.grid_pos,))
-        visited = {self.grid_pos}
-        target = self.get_target_tile()
-        while que:
+        key = (self.grid_pos, self.get_target_tile())
+        path = self._bfs_cache.get(key)
+        if path is None:
+            path = yield from self.breadth_first_search(*key)
+            self._bfs_cache[key] = path
+            if len(self._bfs_cache) > BFS_CACHE_SIZE:
+                self._bfs_cache.popitem(last=False)
+        else:
+            self._bfs_cache.move_to_end(key)
+        return deque(path)
+
+    def breadth_first_search(self, start: tuple[int, int], target: tuple[int, int]):
+        """ A simple Breadth First Search using integer coordinates as our nodes,
+            returns the path with yield from. The pure python search is spread over
+            several ticks, yielding every BFS_STEPS_PER_TICK tiles, so that large
+            maps don't make a single tick slow.
+        """
+        if HAS_NUMBA:
+            path = _bfs(self.passable, start[0], start[1], target[0], target[1])
+            return deque((int(x), int(y)) for x, y in path)
+
+        while self.visited.owner is not None:  # Wait until no other ai is searching
+            yield
+        self._bfs_start(start, target)
+        while not self._bfs_step(BFS_STEPS_PER_TICK):
+            yield
+        self.visited.owner = None
+        return self._bfs_path
+
+    def _bfs_start(self, start: tuple[int, int], target: tuple[int, int]):
+        """ Sets up a new search from start to target, which is then run by _bfs_step. """
+        self._bfs_target = target
+        self._bfs_came_from = {start: None}
+        self._bfs_que = deque((start,))
+        self._bfs_path = None
+        self.visited.new_search(self)
+        self.visited.generations[start[1] * self._w + start[0]] = self.visited.generation
+
+    def _bfs_step(self, limit: int):
+        """ Visits at most limit tiles of the current search. Edges are calculated as we go,
+            using an external function. Every visited tile only remembers the tile it was
+            reached from, the path is rebuilt by walking back from the target once it is found.
+            Returns True when the search is done, the path (empty if the target can't be
+            reached) is then stored in _bfs_path.
+        """
+        que = self._bfs_que
+        came_from = self._bfs_came_from
+        target = self._bfs_target
+        width = self._w
+        visited = self.visited.generations
+        generation = self.visited.generation
+        for _ in range(limit):
+            if not que:
+                self._bfs_path = deque()
+                return True
             current = que.popleft()
             if current == target:
-                return deque(paths[current])
-            for neighbor in self.get_tile_neighbors(current):
-                if neighbor not in visited:
+                path = deque()
+                tile = target
+                while tile is not None:
+                    path.appendleft(tile)
+                    tile = came_from[tile]
+                path.popleft()  # We are already standing on the start tile
+                self._bfs_path = path
+                return True
+            for neighbor in self.get_tile_neighbors(*current):
+                index = neighbor[1] * width + neighbor[0]
+                if visited[index] != generation:
                     que.append(neighbor)
-                    visited.add(neighbor)
-                    paths[neighbor] = paths[current] + [neighbor]
-        return deque()
+                    visited[index] = generation
+                    came_from[neighbor] = current
+        return False
 
     def get_target_tile(self):
         """ Returns position of the flag if we don't have it. If we do have the flag,
@@ -143,7 +358,7 @@ class Ai:
         else:
             self.get_flag()  # Ensure that we have initialized it.
             x, y = self.flag.x, self.flag.y
-        return Vec2d(int(x), int(y))
+        return (int(x), int(y))
 
     def get_flag(self):
         """ This has to be called to get the flag, since we don't know
@@ -151,7 +366,7 @@ class Ai:
         """
         if self.flag is None:
             # Find the flag in the game objects list
-            for obj in self.game_objects_list:
+            for obj in self.game_objects.values():
                 if isinstance(obj, gameobjects.Flag):
                     self.flag = obj
                     break
@@ -160,26 +375,21 @@ class Ai:
     def get_tile_of_position(self, position_vector):
         """ Converts and returns the float position of our tank to an integer position. """
         x, y = position_vector
-        return Vec2d(int(x), int(y))
+        return (int(x), int(y))
 
-    def get_tile_neighbors(self, coord_vec: Vec2d):
+    def get_tile_neighbors(self, x: int, y: int):
         """ Returns all bordering grid squares of the input coordinate.
             A bordering square is only considered accessible if it is grass
             or a wooden box.
         """
-        neighbors = (coord_vec + offset for offset in ((1, 0), (0, 1), (-1, 0), (0, -1)))  # Find the coordinates of the tiles' four neighbors
+        neighbors = ((x + 1, y), (x, y + 1), (x - 1, y), (x, y - 1))  # Find the coordinates of the tiles' four neighbors
         return filter(self.filter_tile_neighbors, neighbors)
 
-    def in_bounds(self, coord: Vec2d):
-        in_horizontal = 0 <= coord.x <= self.max_x
-        in_vertical = 0 <= coord.y <= self.max_y
-        return in_horizontal and in_vertical
-
-    def filter_tile_neighbors(self, coord):
+    def filter_tile_neighbors(self, coord: tuple[int, int]):
         """ Used to filter the tile to check if it is a neighbor of the tank.
         """
-        if not self.in_bounds(coord):
+        x, y = coord
+        if not (0 <= x < self._w and 0 <= y < self._h):
             return False
 
-        box_type = self.current_map.boxAt(*coord)
-        return box_type == 0 or box_type == 2
+        return self.passable_bytes[y * self._w + x] == 1
@@ -12,8 +12,8 @@ pygame.display.set_mode()
 
 import maps
 import game_setup
-from gameobjects import Tank, GameObject, Flag
-from ai import Ai
+from gameobjects import Tank, GameObject, Flag, add_game_object
+from ai import Ai, shoot_all
 
 
 def parse_cli_args() -> bool:
@@ -32,34 +32,43 @@ CONTROLS = ({'up': K_UP, 'down': K_DOWN, 'left': K_LEFT, 'right': K_RIGHT, 'shoo
             {'up': K_w, 'down': K_s, 'left': K_a, 'right': K_d, 'shoot': K_SPACE})
 
 
-def handle_key_down_event(event: pygame.event.Event, players: list[Tank], space: Space, game_objects: list[GameObject]):
+# Maps each key to the index of the player it controls and the name of the Tank method it calls
+KEY_DOWN_ACTIONS = {control[key]: (player_index, action)
+                    for player_index, control in enumerate(CONTROLS)
+                    for key, action in (('up', 'accelerate'), ('down', 'decelerate'), ('left', 'turn_left'),
+                                        ('right', 'turn_right'), ('shoot', 'shoot'))}
+KEY_UP_ACTIONS = {control[key]: (player_index, action)
+                  for player_index, control in enumerate(CONTROLS)
+                  for key, action in (('up', 'stop_moving'), ('down', 'stop_moving'), ('left', 'stop_turning'),
+                                      ('right', 'stop_turning'))}
+
+
+def handle_key_down_event(event: pygame.event.Event, players: list[Tank], space: Space, game_objects: dict[int, GameObject]):
     if len(players) > len(CONTROLS):
         raise ValueError('Too many players where given, dont have enough controls for them all.')
 
-    for player, control in zip(players, CONTROLS):
-        if event.key == control['up']:
-            player.accelerate()
-        elif event.key == control['down']:
-            player.decelerate()
-        elif event.key == control['left']:
-            player.turn_left()
-        elif event.key == control['right']:
-            player.turn_right()
-        elif event.key == control['shoot']:
-            bullet = player.shoot(space)
-            if bullet is not None:
-                game_objects.append(bullet)
+    action = KEY_DOWN_ACTIONS.get(event.key)
+    if action is None or action[0] >= len(players):
+        return
+
+    player_index, method = action
+    player = players[player_index]
+    if method == 'shoot':
+        bullet = player.shoot(space)
+        if bullet is not None:
+            add_game_object(game_objects, bullet)
+    else:
+        getattr(player, method)()
 
 
 def handle_key_up_event(event: pygame.event.Event, players: list[Tank]):
     if len(players) > len(CONTROLS):
         raise ValueError('Too many players where given, dont have enough controls for them all.')
 
-    for player, control in zip(players, CONTROLS):
-        if event.key == control['up'] or event.key == control['down']:
-            player.stop_moving()
-        if event.key == control['left'] or event.key == control['right']:
-            player.stop_turning()
+    action = KEY_UP_ACTIONS.get(event.key)
+    if action is not None and action[0] < len(players):
+        player_index, method = action
+        getattr(players[player_index], method)()
 
 
 def reset_game(tanks: list[Tank], flag: Flag):
@@ -68,13 +77,13 @@ def reset_game(tanks: list[Tank], flag: Flag):
     flag.respawn()
 
 
-def print_score(scores: dict[Tank, int]):
-    for i, score in enumerate(scores.values()):
+def print_score(scores: list[int]):
+    for i, score in enumerate(scores):
         print(f'Player {i + 1}: {score}')
 
 
 def update(
-        game_objects: list[GameObject],
+        game_objects: dict[int, GameObject],
         space: Space,
         tanks: list[Tank],
         flag: Flag,
@@ -82,7 +91,7 @@ def update(
         do_update: bool,
         dt: float,
         update_dt: float,
-        scores: dict[Tank, int],
+        scores: list[int],
         player_amount: int,
 ):
     """ Runs one iteration of the update loop for the game.
@@ -99,33 +108,53 @@ def update(
 
     for ai in ais:
         ai.decide()
+    shoot_all(ais, space)
 
     if do_update:
-        for obj in game_objects:
+        for obj in game_objects.values():
             obj.update(update_dt)
 
     space.step(dt)
 
-    for obj in game_objects:
+    for obj in game_objects.values():
         obj.post_update(dt)
 
     for tank in tanks:
         tank.try_grab_flag(flag)
         if tank.has_won():
-            scores[tank] += 1
+            scores[tank.player_index] += 1
             print_score(scores)
             reset_game(tanks, flag)
 
     return False
 
 
-def draw(screen: Surface, background: Surface, game_objects: list[GameObject]):
-    screen.blit(background, (0, 0))
-
-    for object in game_objects:
-        object.update_screen(screen)
-
-    pygame.display.flip()
+def draw(screen: Surface, background: Surface, game_objects: dict[int, GameObject], drawn_objects: dict[int, GameObject]):
+    """ Only redraws the parts of the screen where an object has moved, turned, appeared
+        or disappeared since the last frame. drawn_objects holds the objects that were
+        drawn in the last frame, and is updated to hold the ones drawn in this frame.
+    """
+    dirty = [object.rect for key, object in drawn_objects.items() if game_objects.get(key) is not object]
+    for object in game_objects.values():
+        if object.move_on_screen():
+            if object.prev_rect is None:
+                dirty.append(object.rect)
+            else:
+                dirty.append(object.rect.union(object.prev_rect))
+
+    for rect in dirty:
+        # Restore the background and redraw every object overlapping the rect, clipped
+        # to it, so that the objects are still drawn on top of each other in the right order
+        screen.set_clip(rect)
+        screen.blit(background, rect, rect)
+        for object in game_objects.values():
+            if rect.colliderect(object.rect):
+                object.update_screen(screen)
+    screen.set_clip(None)
+
+    drawn_objects.clear()
+    drawn_objects.update(game_objects)
+    pygame.display.update(dirty)
 
 
 def main():
@@ -141,15 +170,20 @@ def main():
     # setup
     player_amount = 2 if parse_cli_args() else 1
     screen = pygame.display.set_mode(current_map.rect().size)
+    pygame.event.set_blocked([MOUSEMOTION, ACTIVEEVENT])  # Let SDL drop events we never use
 
     space = game_setup.space_set_up()
     game_objects, tanks, flag, ais = game_setup.create_game_objects(current_map, space, player_amount)
-    scores = {tank: 0 for tank in tanks}
-    background = game_setup.get_background(current_map.rect().size)
+    scores = [0] * len(tanks)
+    background = game_setup.get_background(current_map)
 
     game_setup.add_collision_handlers(game_objects, space)
     game_setup.create_borders(current_map.width, current_map.height, space)
 
+    screen.blit(background, (0, 0))
+    pygame.display.flip()
+    drawn_objects = {}
+
     while running:
         dt = clock.tick(FRAMERATE) / 1000
         update_dt += dt
@@ -164,7 +198,7 @@ def main():
         else:
             skip_update -= 1
 
-        draw(screen, background, game_objects)
+        draw(screen, background, game_objects, drawn_objects)
 
 
 if __name__ == '__main__':
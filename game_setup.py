@@ -1,10 +1,12 @@
 from typing import Literal
+import numpy as np
+import pygame
 from pygame import Surface
 from pymunk import Space, Arbiter, Body, Segment
 
 import images
-from gameobjects import GameObject, GameVisibleObject, Box, Tank, Flag, Bullet, get_box_with_type
-from ai import Ai
+from gameobjects import GameObject, GameVisibleObject, Box, Tank, Flag, Bullet, get_box_with_type, add_game_object, remove_game_object, ROTATION_STEP
+from ai import Ai, VisitedTiles, compile_bfs
 from maps import Map
 
 
@@ -16,13 +18,23 @@ def space_set_up() -> Space:
     return space
 
 
-def get_background(size: tuple[int, int]) -> Surface:
-    """Create and return a background image with grass texture."""
-    background = Surface(size)
+def get_background(current_map: Map) -> Surface:
+    """Create and return a background image with grass texture, covering the whole map."""
+    width = current_map.width * images.TILE_SIZE
+    height = current_map.height * images.TILE_SIZE
+    background = Surface((width, height))
+    background.blit(images.grass, (0, 0))
 
-    for y in range(size[1]):
-        for x in range(size[0]):
-            background.blit(images.grass, (x * images.TILE_SIZE, y * images.TILE_SIZE))
+    # Copy the part that is already drawn next to itself, doubling its size each time
+    drawn_width = images.TILE_SIZE
+    while drawn_width < width:
+        background.blit(background, (drawn_width, 0), (0, 0, drawn_width, images.TILE_SIZE))
+        drawn_width *= 2
+
+    drawn_height = images.TILE_SIZE
+    while drawn_height < height:
+        background.blit(background, (0, drawn_height), (0, 0, width, drawn_height))
+        drawn_height *= 2
 
     return background
 
@@ -50,36 +62,60 @@ def create_boxes(map: Map, space: Space) -> list[Box]:
     return boxes
 
 
+def create_passable_grid(map: Map) -> tuple[np.ndarray, bytes]:
+    """Create and return a grid where tiles that are grass or a wooden box are 1 and all others are 0.
+    The grid is also returned as flat bytes indexed by y * width + x, which is much faster to read from python."""
+    passable = np.ones((map.height, map.width), dtype=np.uint8)
+    for y in range(map.height):
+        for x in range(map.width):
+            box_type = map.boxAt(x, y)
+            if box_type != 0 and box_type != 2:
+                passable[y, x] = 0
+
+    return passable, passable.tobytes()
+
+
+def get_rotated_sprites(sprite: Surface) -> list[Surface]:
+    """Create and return a list of the sprite rotated by every multiple of ROTATION_STEP degrees."""
+    return [pygame.transform.rotate(sprite, angle) for angle in range(0, 360, ROTATION_STEP)]
+
+
 def create_tanks(
         positions: list[tuple[float, float, float]],
         space: Space,
         player_amount: int,
-        game_objects: list[GameObject],
+        game_objects: dict[int, GameObject],
         current_map: Map,
 ) -> tuple[list[Tank], list[Ai]]:
     """Creates and returns a list of tanks and AI:s."""
     tanks = []
     ais = []
-    for (x, y, orientation), image in zip(positions, images.tanks):
+    visited = VisitedTiles(current_map.width, current_map.height)  # Shared by all ai:s
+    for player_index, ((x, y, orientation), image) in enumerate(zip(positions, images.tanks)):
         if player_amount <= 0:
-            tank = Tank(x, y, orientation, image, space, True)
-            ais.append(Ai(tank, game_objects, tanks, space, current_map))
+            tank = Tank(x, y, orientation, image, space, True, player_index)
+            ais.append(Ai(tank, game_objects, tanks, space, current_map, visited))
         else:
-            tank = Tank(x, y, orientation, image, space, False)
+            tank = Tank(x, y, orientation, image, space, False, player_index)
             player_amount -= 1
+        tank.rotated_cache = get_rotated_sprites(image)
         tanks.append(tank)
 
     return tanks, ais
 
 
-def create_game_objects(map: Map, space: Space, player_amount: int) -> tuple[list[GameObject], list[Tank], Flag, list[Ai]]:
+def create_game_objects(map: Map, space: Space, player_amount: int) -> tuple[dict[int, GameObject], list[Tank], Flag, list[Ai]]:
     """Creates all game objects needed for the game."""
-    game_objects = create_bases(map.start_positions)
-    game_objects.extend(create_boxes(map, space))
+    game_objects = {}
+    for obj in create_bases(map.start_positions) + create_boxes(map, space):
+        add_game_object(game_objects, obj)
+    map.passable, map.passable_bytes = create_passable_grid(map)
+    compile_bfs(map.passable)
     tanks, ais = create_tanks(map.start_positions, space, player_amount, game_objects, map)
-    game_objects.extend(tanks)
+    for tank in tanks:
+        add_game_object(game_objects, tank)
     flag = Flag(*map.flag_position)
-    game_objects.append(flag)
+    add_game_object(game_objects, flag)
     return game_objects, tanks, flag, ais
 
 
@@ -94,16 +130,15 @@ def create_borders(width: float, height: float, space: Space):
     space.add(borders, top, right, bottom, left)
 
 
-def add_bullet_tank_collision_handler(game_objects: list[GameObject], space: Space):
-    def collision_handler(arbiter: Arbiter, space: Space, data: dict[Literal['game_objects'], list[GameObject]]):
+def add_bullet_tank_collision_handler(game_objects: dict[int, GameObject], space: Space):
+    def collision_handler(arbiter: Arbiter, space: Space, data: dict[Literal['game_objects'], dict[int, GameObject]]):
         bullet, tank = arbiter.shapes
         bullet: Bullet = bullet.parent
         tank: Tank = tank.parent
         tank.get_hit()
         bullet.remove(space)
         game_objects = data['game_objects']
-        if bullet in game_objects:
-            game_objects.remove(bullet)
+        remove_game_object(game_objects, bullet)
 
         return False
 
@@ -112,8 +147,8 @@ def add_bullet_tank_collision_handler(game_objects: list[GameObject], space: Spa
     handler.pre_solve = collision_handler
 
 
-def add_bullet_wood_box_collision_handler(game_objects: list[GameObject], space: Space):
-    def collision_handler(arbiter: Arbiter, space: Space, data: dict[Literal['game_objects'], list[GameObject]]):
+def add_bullet_wood_box_collision_handler(game_objects: dict[int, GameObject], space: Space):
+    def collision_handler(arbiter: Arbiter, space: Space, data: dict[Literal['game_objects'], dict[int, GameObject]]):
         bullet, box = arbiter.shapes
         bullet: Bullet = bullet.parent
         box: Box = box.parent
@@ -122,12 +157,10 @@ def add_bullet_wood_box_collision_handler(game_objects: list[GameObject], space:
 
         if box.get_hit():
             box.remove(space)
-            if box in game_objects:
-                game_objects.remove(box)
+            remove_game_object(game_objects, box)
 
         bullet.remove(space)
-        if bullet in game_objects:
-            game_objects.remove(bullet)
+        remove_game_object(game_objects, bullet)
 
         return False
 
@@ -136,14 +169,13 @@ def add_bullet_wood_box_collision_handler(game_objects: list[GameObject], space:
     handler.pre_solve = collision_handler
 
 
-def add_bullet_other_collision_handler(game_objects: list[GameObject], space: Space):
-    def collision_handler(arbiter: Arbiter, space: Space, data: dict[Literal['game_objects'], list[GameObject]]):
+def add_bullet_other_collision_handler(game_objects: dict[int, GameObject], space: Space):
+    def collision_handler(arbiter: Arbiter, space: Space, data: dict[Literal['game_objects'], dict[int, GameObject]]):
         bullet, _ = arbiter.shapes
         bullet: Bullet = bullet.parent
         game_objects = data['game_objects']
         bullet.remove(space)
-        if bullet in game_objects:
-            game_objects.remove(bullet)
+        remove_game_object(game_objects, bullet)
 
         return False
 
@@ -152,7 +184,7 @@ def add_bullet_other_collision_handler(game_objects: list[GameObject], space: Sp
     handler.pre_solve = collision_handler
 
 
-def add_collision_handlers(game_objects: list[GameObject], space: Space):
+def add_collision_handlers(game_objects: dict[int, GameObject], space: Space):
     add_bullet_tank_collision_handler(game_objects, space)
     add_bullet_wood_box_collision_handler(game_objects, space)
     add_bullet_other_collision_handler(game_objects, space)
@@ -6,6 +6,7 @@ import pymunk
 import images
 
 DEBUG = False  # Change this to set it in debug mode
+ROTATION_STEP = 2  # Angle in degrees between the sprites of a rotation cache
 
 
 def physics_to_display(x):
@@ -21,6 +22,11 @@ class GameObject:
 
     def __init__(self, sprite: pygame.Surface):
         self.sprite = sprite
+        self.screen_sprite = None  # The rotated sprite, as it is drawn on the screen
+        self.rect = None           # The rectangle covered by screen_sprite on the screen
+        self.prev_rect = None      # The rectangle that was covered before the last move
+        self.screen_state = None   # The position and orientation screen_sprite and rect were computed for
+        self.rotated_cache = None  # Optional list of the sprite rotated by every multiple of ROTATION_STEP degrees
 
     def update(self, dt: float):
         """ Placeholder, supposed to be implemented in a subclass.
@@ -32,13 +38,24 @@ class GameObject:
             other objects than itself."""
         return
 
-    def update_screen(self, screen):
-        """ Updates the visual part of the game. Should NOT need to be changed
-            by a subclass."""
-        sprite = self.sprite
-
+    def move_on_screen(self):
+        """ Recomputes screen_sprite and rect if the object has moved or turned since
+            the last call. Returns True if it has, the old rect is then kept in prev_rect.
+            Should NOT need to be changed by a subclass."""
         p = self.screen_position()  # Get the position of the object (pygame coordinates)
-        sprite = pygame.transform.rotate(sprite, self.screen_orientation())  # Rotate the sprite using the rotation of the object
+        orientation = self.screen_orientation()
+        if self.rotated_cache is not None:
+            # Round to the closest pre-rotated sprite instead of rotating the sprite every frame
+            orientation = round(orientation / ROTATION_STEP) % len(self.rotated_cache)
+        state = (p[0], p[1], orientation)
+        if state == self.screen_state:
+            return False
+
+        self.screen_state = state
+        if self.rotated_cache is not None:
+            sprite = self.rotated_cache[orientation]
+        else:
+            sprite = pygame.transform.rotate(self.sprite, orientation)  # Rotate the sprite using the rotation of the object
 
         # The position of the screen correspond to the center of the object,
         # but the function screen.blit expect to receive the top left corner
@@ -47,7 +64,27 @@ class GameObject:
         # corner of the sprite
         offset = pymunk.Vec2d(*sprite.get_size()) / 2.
         p = p - offset
-        screen.blit(sprite, p)  # Copy the sprite on the screen
+        self.screen_sprite = sprite
+        self.prev_rect = self.rect
+        self.rect = pygame.Rect(int(p[0]), int(p[1]), *sprite.get_size())
+        return True
+
+    def update_screen(self, screen):
+        """ Updates the visual part of the game. Should NOT need to be changed
+            by a subclass."""
+        self.move_on_screen()
+        screen.blit(self.screen_sprite, self.rect)  # Copy the sprite on the screen
+
+
+def add_game_object(game_objects: dict[int, GameObject], obj: GameObject):
+    """ Adds obj to game_objects. The dict keeps the order objects were added in,
+        which is also the order they are drawn in. """
+    game_objects[id(obj)] = obj
+
+
+def remove_game_object(game_objects: dict[int, GameObject], obj: GameObject):
+    """ Removes obj from game_objects, does nothing if it was already removed. """
+    game_objects.pop(id(obj), None)
 
 
 class GamePhysicsObject(GameObject):
@@ -135,9 +172,12 @@ class Bullet(GamePhysicsObject):
     def __init__(self, x, y, orientation, speed, space):
         self.speed = speed
         super().__init__(x, y, orientation, images.bullet, space, True, self.COLLISION_TYPE)
+        # A bullet always flies straight ahead, so the velocity only has to be calculated once
+        self.velocity = pymunk.Vec2d(0, self.speed).rotated(self.body.angle)
 
     def update(self, dt: float):
-        self.body.velocity = pymunk.Vec2d(0, self.speed).rotated(self.body.angle)
+        # Restore the velocity, since the damping of the space slows the bullet down every step
+        self.body.velocity = self.velocity
 
 
 class Tank(GamePhysicsObject):
@@ -168,9 +208,11 @@ class Tank(GamePhysicsObject):
     normal_max_speed: float
     flag_max_speed: float
     bullet_speed: float
+    player_index: int
 
-    def __init__(self, x, y, orientation, sprite, space, unfair_ai):
+    def __init__(self, x, y, orientation, sprite, space, unfair_ai, player_index):
         super().__init__(x, y, orientation, sprite, space, True, self.COLLISION_TYPE)
+        self.player_index = player_index  # Index of the tank in the list of tanks, used for the scores
         self.acceleration = 0
         self.rotation = 0
 
@@ -14,6 +14,8 @@ class Map:
         self.boxes = boxes
         self.start_positions = start_positions
         self.flag_position = flag_position
+        self.passable = None  # Grid of tiles the ai can drive through, created by game_setup
+        self.passable_bytes = None  # The same grid as flat bytes, indexed by y * width + x
 
     def rect(self):
         return pygame.Rect(0, 0, images.TILE_SIZE * self.width, images.TILE_SIZE * self.height)
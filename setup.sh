@@ -37,4 +37,6 @@ source ctf-env/bin/activate
 # Make sure the required libraries are installed
 pip install pymunk==6.5.1
 pip install pygame==2.5.0
+pip install numpy==1.26.2
+pip install numba==0.58.1
 pip install pycodestyle